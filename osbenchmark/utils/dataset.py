@@ -7,10 +7,10 @@
 import os
 import struct
 from abc import ABC, ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, wait
 from enum import Enum
-from typing import cast
+from typing import Optional, cast
 
-import h5py
 import numpy as np
 
 from osbenchmark.exceptions import InvalidExtensionException
@@ -40,9 +40,11 @@ class DataSet(ABC):
     BEGINNING = 0
 
     @abstractmethod
-    def read(self, chunk_size: int):
+    def read(self, chunk_size: int, out: Optional[np.ndarray] = None):
         """Read vector for given chunk size
         @param chunk_size: limits vector size to read
+        @param out: optional array with room for chunk_size vectors to read
+        into, so callers can reuse one buffer across reads
         """
 
     @abstractmethod
@@ -65,20 +67,26 @@ class DataSet(ABC):
         """
 
 
-def get_data_set(data_set_format: str, path: str, context: Context):
+def get_data_set(data_set_format: str, path: str, context: Context, prefetch: bool = False):
     """
     Factory method to get instance of Dataset for given format.
     Args:
         data_set_format: File format like hdf5, bigann
         path: Data set file path
         context: Dataset Context Enum
+        prefetch: Read the next chunk in the background while the current
+        one is processed
     Returns: DataSet instance
     """
     if data_set_format == HDF5DataSet.FORMAT_NAME:
-        return HDF5DataSet(path, context)
-    if data_set_format == BigANNVectorDataSet.FORMAT_NAME:
-        return BigANNVectorDataSet(path)
-    raise ConfigurationError("Invalid data set format")
+        data_set = HDF5DataSet(path, context)
+    elif data_set_format == BigANNVectorDataSet.FORMAT_NAME:
+        data_set = BigANNVectorDataSet(path)
+    else:
+        raise ConfigurationError("Invalid data set format")
+    if prefetch:
+        return PrefetchingDataSet(data_set)
+    return data_set
 
 
 class HDF5DataSet(DataSet):
@@ -88,30 +96,62 @@ class HDF5DataSet(DataSet):
 
     FORMAT_NAME = "hdf5"
 
+    # HDF5 only caches 1 MiB of chunks per data set by default, which is not
+    # enough to hold a single chunk of most chunked vector data sets
+    CHUNK_CACHE_BYTES = 256 << 20
+    CHUNK_CACHE_SLOTS = 1_000_003
+    CHUNK_CACHE_PREEMPTION_POLICY = 0.75
+
     def __init__(self, dataset_path: str, context: Context):
         self.dataset_path = dataset_path
         self.context = self.parse_context(context)
         self.current = self.BEGINNING
         self.data = None
+        self.num_points = 0
+        self.buffer = None
 
     def _load(self):
         if self.data is None:
-            file = h5py.File(self.dataset_path)
+            # h5py is only imported once an HDF5 data set is used, it takes
+            # noticeably longer to import than the rest of this module
+            # pylint: disable=import-outside-toplevel
+            import h5py
+            file = h5py.File(self.dataset_path, 'r',
+                             rdcc_nbytes=self.CHUNK_CACHE_BYTES,
+                             rdcc_nslots=self.CHUNK_CACHE_SLOTS,
+                             rdcc_w0=self.CHUNK_CACHE_PREEMPTION_POLICY)
             self.data = cast(h5py.Dataset, file[self.context])
+            self.num_points = self.data.len()
 
-    def read(self, chunk_size: int):
+    def read(self, chunk_size: int, out: Optional[np.ndarray] = None):
+        """Read vector for given chunk size
+        @param chunk_size: limits vector size to read
+        @param out: optional array with room for chunk_size vectors to read
+        into
+        @return: view into out or, if out is not given, into a buffer owned
+        by the data set, which is overwritten by the next call to read
+        """
         # load file first before read
         self._load()
-        if self.current >= self.size():
+        if self.current >= self.num_points:
             return None
 
         end_offset = self.current + chunk_size
-        if end_offset > self.size():
-            end_offset = self.size()
-
-        vectors = cast(np.ndarray, self.data[self.current:end_offset])
+        if end_offset > self.num_points:
+            end_offset = self.num_points
+
+        if out is None:
+            # reuse the same buffer across reads instead of allocating a new
+            # array for every chunk
+            if self.buffer is None or len(self.buffer) < chunk_size:
+                self.buffer = np.empty((chunk_size,) + self.data.shape[1:],
+                                       dtype=self.data.dtype)
+            out = self.buffer
+        num_vectors = end_offset - self.current
+        self.data.read_direct(out, np.s_[self.current:end_offset],
+                              np.s_[:num_vectors])
         self.current = end_offset
-        return vectors
+        return out[:num_vectors]
 
     def seek(self, offset: int):
         if offset < self.BEGINNING:
@@ -125,7 +165,7 @@ class HDF5DataSet(DataSet):
     def size(self):
         # load file first before return size
         self._load()
-        return self.data.len()
+        return self.num_points
 
     def reset(self):
         self.current = self.BEGINNING
@@ -167,19 +207,21 @@ class BigANNVectorDataSet(DataSet):
         self.num_points = 0
         self.dimension = 0
         self.bytes_per_num = 0
+        self.vector_bytes = 0
+        self.dtype = None
+        self.mmap = None
 
     def _init_internal_params(self):
-        self.file = open(self.dataset_path, 'rb')
-        self.file.seek(BigANNVectorDataSet.BEGINNING, os.SEEK_END)
-        num_bytes = self.file.tell()
-        self.file.seek(BigANNVectorDataSet.BEGINNING)
-
+        num_bytes = os.stat(self.dataset_path).st_size
         if num_bytes < BigANNVectorDataSet.DATA_SET_HEADER_LENGTH:
             raise Exception("Invalid file: file size cannot be less than {} bytes".format(
                 BigANNVectorDataSet.DATA_SET_HEADER_LENGTH))
 
-        self.num_points = int.from_bytes(self.file.read(4), "little")
-        self.dimension = int.from_bytes(self.file.read(4), "little")
+        self.file = open(self.dataset_path, 'rb')
+        # vectors are read front to back, let the kernel read ahead further
+        self._advise(BigANNVectorDataSet.BEGINNING, 0, "POSIX_FADV_SEQUENTIAL")
+        self.num_points, self.dimension = struct.unpack(
+            '<II', self.file.read(BigANNVectorDataSet.DATA_SET_HEADER_LENGTH))
         self.bytes_per_num = self._get_data_size(self.dataset_path)
 
         if (num_bytes - BigANNVectorDataSet.DATA_SET_HEADER_LENGTH) != (
@@ -187,29 +229,90 @@ class BigANNVectorDataSet(DataSet):
             raise Exception("Invalid file. File size is not matching with expected estimated "
                             "value based on number of points, dimension and bytes per point")
 
-        self.reader = self._value_reader(self.dataset_path)
+        self.vector_bytes = self.dimension * self.bytes_per_num
+        self.dtype = self._get_data_type(self.dataset_path)
+        try:
+            self.mmap = np.memmap(self.file, dtype=self.dtype, mode='r',
+                                  offset=BigANNVectorDataSet.DATA_SET_HEADER_LENGTH,
+                                  shape=(self.num_points, self.dimension))
+        except OSError:
+            # not every file system supports memory mapping, fall back to
+            # reading from the file
+            self.mmap = None
 
     def _load(self):
         # load file if it is not loaded yet
         if self.file is None:
             self._init_internal_params()
 
-    def read(self, chunk_size: int):
+    def read(self, chunk_size: int, out: Optional[np.ndarray] = None):
+        """Read vector for given chunk size
+        @param chunk_size: limits vector size to read
+        @param out: optional array with room for chunk_size vectors to read
+        into
+        @return: uint8 array for .u8bin, float32 array for .fbin. If the file
+        is memory mapped and out is not given, this is a read-only view into
+        the file
+        """
         # load file first before read
         self._load()
-        if self.current >= self.size():
+        if self.current >= self.num_points:
             return None
 
         end_offset = self.current + chunk_size
-        if end_offset > self.size():
-            end_offset = self.size()
-
-        vectors = np.asarray(
-            [self._read_vector() for _ in range(end_offset - self.current)]
-        )
+        if end_offset > self.num_points:
+            end_offset = self.num_points
+
+        self._prefetch(end_offset, chunk_size)
+        num_vectors = end_offset - self.current
+        if self.mmap is None:
+            vectors = self._read_vectors(num_vectors, out)
+        else:
+            # vectors are a read-only view into the memory mapped file, so no
+            # data is copied
+            vectors = self.mmap[self.current:end_offset]
+            if out is not None:
+                np.copyto(out[:num_vectors], vectors)
+                vectors = out[:num_vectors]
         self.current = end_offset
         return vectors
 
+    def _read_vectors(self, num_vectors: int, out: Optional[np.ndarray]):
+        # read all vectors of the chunk with a single call, straight into the
+        # returned array when possible, so no intermediate bytes are allocated
+        target = None if out is None else out[:num_vectors]
+        if target is not None and target.dtype == self.dtype and target.flags.c_contiguous:
+            vectors = target
+        else:
+            vectors = np.empty((num_vectors, self.dimension), dtype=self.dtype)
+        self.file.readinto(vectors)
+        if target is not None and vectors is not target:
+            np.copyto(target, vectors)
+            return target
+        return vectors
+
+    def _get_bytes_offset(self, offset: int):
+        return BigANNVectorDataSet.DATA_SET_HEADER_LENGTH + offset * self.vector_bytes
+
+    def _prefetch(self, offset: int, chunk_size: int):
+        # ask the kernel to start reading the chunk after this one in the
+        # background, so it is in the page cache by the time it is accessed
+        if offset >= self.num_points:
+            return
+        num_vectors = min(chunk_size, self.num_points - offset)
+        self._advise(self._get_bytes_offset(offset), num_vectors * self.vector_bytes,
+                     "POSIX_FADV_WILLNEED")
+
+    def _advise(self, offset: int, length: int, advice: str):
+        # access pattern hints are only available on some platforms and are
+        # never required for correctness
+        if not hasattr(os, "posix_fadvise"):
+            return
+        try:
+            os.posix_fadvise(self.file.fileno(), offset, length, getattr(os, advice))
+        except OSError:
+            pass
+
     def seek(self, offset: int):
         # load file first before seek
         self._load()
@@ -219,26 +322,22 @@ class BigANNVectorDataSet(DataSet):
         if offset >= self.size():
             raise Exception("Offset must be less than the data set size")
 
-        bytes_offset = BigANNVectorDataSet.DATA_SET_HEADER_LENGTH + (
-                self.dimension * self.bytes_per_num * offset)
-        self.file.seek(bytes_offset)
+        if self.mmap is None:
+            self.file.seek(self._get_bytes_offset(offset))
         self.current = offset
 
-    def _read_vector(self):
-        return np.asarray([self.reader(self.file) for _ in
-                           range(self.dimension)])
-
     def size(self):
         # load file first before return size
         self._load()
         return self.num_points
 
     def reset(self):
-        if self.file:
+        if self.file and self.mmap is None:
             self.file.seek(BigANNVectorDataSet.DATA_SET_HEADER_LENGTH)
         self.current = BigANNVectorDataSet.BEGINNING
 
     def __del__(self):
+        self.mmap = None
         if self.file:
             self.file.close()
 
@@ -261,10 +360,91 @@ class BigANNVectorDataSet(DataSet):
             return BigANNVectorDataSet.BYTES_PER_FLOAT
 
     @staticmethod
-    def _value_reader(file_name):
+    def _get_data_type(file_name):
         ext = BigANNVectorDataSet._get_extension(file_name)
         if ext == BigANNVectorDataSet.U8BIN_EXTENSION:
-            return lambda file: float(int.from_bytes(file.read(BigANNVectorDataSet.BYTES_PER_U8INT), "little"))
+            return np.uint8
 
         if ext == BigANNVectorDataSet.FBIN_EXTENSION:
-            return lambda file: struct.unpack('<f', file.read(BigANNVectorDataSet.BYTES_PER_FLOAT))
+            return np.float32
+
+
+class PrefetchingDataSet(DataSet):
+    """ Wraps a data-set and reads the next chunk on a background thread while
+    the caller processes the current one. Chunks are copied into two
+    alternating buffers, so an array returned by read is only valid until
+    the next call to read.
+    """
+
+    def __init__(self, data_set: DataSet):
+        self.data_set = data_set
+        self.current = self.BEGINNING
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.buffers = [None, None]
+        self.buffer_index = 0
+        self.next_chunk = None
+        self.chunk_size = 0
+
+    def _load_next(self, chunk_size: int, buffer_index: int):
+        buffer = self.buffers[buffer_index]
+        if buffer is not None and len(buffer) >= chunk_size:
+            return self.data_set.read(chunk_size, out=buffer)
+
+        vectors = self.data_set.read(chunk_size)
+        if vectors is None:
+            return None
+
+        buffer = np.empty((chunk_size,) + vectors.shape[1:], dtype=vectors.dtype)
+        self.buffers[buffer_index] = buffer
+        num_vectors = len(vectors)
+        np.copyto(buffer[:num_vectors], vectors)
+        return buffer[:num_vectors]
+
+    def _submit_next_chunk(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.next_chunk = self.executor.submit(self._load_next, chunk_size, self.buffer_index)
+        self.buffer_index = 1 - self.buffer_index
+
+    def _discard_next_chunk(self):
+        if self.next_chunk is not None:
+            wait([self.next_chunk])
+            self.next_chunk = None
+
+    def read(self, chunk_size: int, out: Optional[np.ndarray] = None):
+        if self.next_chunk is not None and chunk_size != self.chunk_size:
+            # prefetched chunk has the wrong size, move the wrapped data set
+            # back to where the caller expects to continue reading
+            self._discard_next_chunk()
+            if self.current < self.data_set.size():
+                self.data_set.seek(self.current)
+
+        if self.next_chunk is None:
+            self._submit_next_chunk(chunk_size)
+        vectors = self.next_chunk.result()
+        self.next_chunk = None
+        if vectors is None:
+            return None
+
+        num_vectors = len(vectors)
+        self.current += num_vectors
+        self._submit_next_chunk(chunk_size)
+        if out is not None:
+            np.copyto(out[:num_vectors], vectors)
+            return out[:num_vectors]
+        return vectors
+
+    def seek(self, offset: int):
+        self._discard_next_chunk()
+        self.data_set.seek(offset)
+        self.current = offset
+
+    def size(self):
+        return self.data_set.size()
+
+    def reset(self):
+        self._discard_next_chunk()
+        self.data_set.reset()
+        self.current = self.BEGINNING
+
+    def __del__(self):
+        self.executor.shutdown(wait=False)
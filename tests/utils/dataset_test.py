@@ -3,12 +3,17 @@
 # The OpenSearch Contributors require contributions made to
 # this file be licensed under the Apache-2.0 license or a
 # compatible open source license.
+import os
 import tempfile
-from unittest import TestCase
+from unittest import TestCase, mock
 
-from osbenchmark.utils.dataset import Context, get_data_set, HDF5DataSet, BigANNVectorDataSet
+import numpy as np
+
+from osbenchmark.utils.dataset import Context, get_data_set, HDF5DataSet, BigANNVectorDataSet, \
+    PrefetchingDataSet
 from osbenchmark.utils.parse import ConfigurationError
-from tests.utils.dataset_helper import create_data_set
+from tests.utils.dataset_helper import create_data_set, BigANNBuilder, DataSetBuildContext, \
+    HDF5Builder, create_random_2d_array
 
 DEFAULT_INDEX_NAME = "test-index"
 DEFAULT_FIELD_NAME = "test-field"
@@ -33,6 +38,41 @@ class DataSetTestCase(TestCase):
             self.assertEqual(data_set_instance.FORMAT_NAME, HDF5DataSet.FORMAT_NAME)
             self.assertEqual(data_set_instance.size(), DEFAULT_NUM_VECTORS)
 
+    def testHDF5ReadInChunks(self):
+        with tempfile.TemporaryDirectory() as data_set_dir:
+            vectors = create_random_2d_array(DEFAULT_NUM_VECTORS, DEFAULT_DIMENSION)
+            data_set_path = os.path.join(data_set_dir, "data.hdf5")
+            HDF5Builder().add_data_set_build_context(
+                DataSetBuildContext(DEFAULT_CONTEXT, vectors, data_set_path)).build()
+
+            data_set_instance = HDF5DataSet(data_set_path, DEFAULT_CONTEXT)
+            np.testing.assert_array_equal(data_set_instance.read(4), vectors[0:4])
+            np.testing.assert_array_equal(data_set_instance.read(4), vectors[4:8])
+            np.testing.assert_array_equal(data_set_instance.read(4), vectors[8:10])
+            self.assertIsNone(data_set_instance.read(4))
+
+            data_set_instance.seek(3)
+            np.testing.assert_array_equal(data_set_instance.read(2), vectors[3:5])
+
+    def testReadIntoCallerBuffer(self):
+        with tempfile.TemporaryDirectory() as data_set_dir:
+            vectors = create_random_2d_array(DEFAULT_NUM_VECTORS, DEFAULT_DIMENSION)
+            hdf5_path = os.path.join(data_set_dir, "data.hdf5")
+            HDF5Builder().add_data_set_build_context(
+                DataSetBuildContext(DEFAULT_CONTEXT, vectors, hdf5_path)).build()
+            bigann_path = os.path.join(data_set_dir, "data.fbin")
+            BigANNBuilder().add_data_set_build_context(
+                DataSetBuildContext(DEFAULT_CONTEXT, vectors, bigann_path)).build()
+
+            for data_set_instance in [HDF5DataSet(hdf5_path, DEFAULT_CONTEXT), BigANNVectorDataSet(bigann_path)]:
+                out = np.zeros((6, DEFAULT_DIMENSION), dtype=np.float32)
+                chunk = data_set_instance.read(6, out=out)
+                np.testing.assert_array_equal(chunk, vectors[0:6])
+                self.assertIs(chunk.base, out)
+                chunk = data_set_instance.read(6, out=out)
+                np.testing.assert_array_equal(chunk, vectors[6:10])
+                self.assertIsNone(data_set_instance.read(6, out=out))
+
     def testBigANNAsAcceptableDataSetFormatWithFloatExtension(self):
         float_extension = "fbin"
         data_set_dir = tempfile.mkdtemp()
@@ -48,6 +88,88 @@ class DataSetTestCase(TestCase):
         self.assertEqual(data_set_instance.FORMAT_NAME, BigANNVectorDataSet.FORMAT_NAME)
         self.assertEqual(data_set_instance.size(), DEFAULT_NUM_VECTORS)
 
+    def testBigANNReadInChunks(self):
+        with tempfile.TemporaryDirectory() as data_set_dir:
+            vectors = create_random_2d_array(DEFAULT_NUM_VECTORS, DEFAULT_DIMENSION)
+            data_set_path = os.path.join(data_set_dir, "data.fbin")
+            BigANNBuilder().add_data_set_build_context(
+                DataSetBuildContext(DEFAULT_CONTEXT, vectors, data_set_path)).build()
+
+            data_set_instance = BigANNVectorDataSet(data_set_path)
+            np.testing.assert_array_equal(data_set_instance.read(4), vectors[0:4])
+            np.testing.assert_array_equal(data_set_instance.read(4), vectors[4:8])
+            np.testing.assert_array_equal(data_set_instance.read(4), vectors[8:10])
+            self.assertIsNone(data_set_instance.read(4))
+
+            data_set_instance.seek(3)
+            np.testing.assert_array_equal(data_set_instance.read(2), vectors[3:5])
+
+            data_set_instance.reset()
+            chunk = data_set_instance.read(2)
+            np.testing.assert_array_equal(chunk, vectors[0:2])
+            self.assertFalse(chunk.flags.writeable)
+
+    @mock.patch("numpy.memmap", side_effect=OSError("mmap not supported"))
+    def testBigANNReadWithoutMemoryMapping(self, _):
+        with tempfile.TemporaryDirectory() as data_set_dir:
+            vectors = create_random_2d_array(DEFAULT_NUM_VECTORS, DEFAULT_DIMENSION)
+            data_set_path = os.path.join(data_set_dir, "data.fbin")
+            BigANNBuilder().add_data_set_build_context(
+                DataSetBuildContext(DEFAULT_CONTEXT, vectors, data_set_path)).build()
+
+            data_set_instance = BigANNVectorDataSet(data_set_path)
+            np.testing.assert_array_equal(data_set_instance.read(4), vectors[0:4])
+            self.assertIsNone(data_set_instance.mmap)
+            np.testing.assert_array_equal(data_set_instance.read(8), vectors[4:10])
+            self.assertIsNone(data_set_instance.read(4))
+
+            data_set_instance.seek(3)
+            np.testing.assert_array_equal(data_set_instance.read(2), vectors[3:5])
+            data_set_instance.reset()
+            np.testing.assert_array_equal(data_set_instance.read(2), vectors[0:2])
+
+            out = np.zeros((4, DEFAULT_DIMENSION), dtype=np.float32)
+            chunk = data_set_instance.read(4, out=out)
+            np.testing.assert_array_equal(chunk, vectors[2:6])
+            self.assertIs(chunk.base, out)
+            out = np.zeros((4, DEFAULT_DIMENSION), dtype=np.float64)
+            np.testing.assert_array_equal(data_set_instance.read(4, out=out), vectors[6:10])
+
+    def testBigANNReadWithUInt8Extension(self):
+        with tempfile.TemporaryDirectory() as data_set_dir:
+            vectors = np.random.default_rng().integers(
+                0, 256, size=(DEFAULT_NUM_VECTORS, DEFAULT_DIMENSION), dtype=np.uint8)
+            data_set_path = os.path.join(data_set_dir, "data.u8bin")
+            BigANNBuilder().add_data_set_build_context(
+                DataSetBuildContext(DEFAULT_CONTEXT, vectors, data_set_path)).build()
+
+            data_set_instance = BigANNVectorDataSet(data_set_path)
+            chunk = data_set_instance.read(DEFAULT_NUM_VECTORS)
+            self.assertEqual(chunk.dtype, np.uint8)
+            np.testing.assert_array_equal(chunk, vectors)
+
+    def testPrefetchingDataSetRead(self):
+        with tempfile.TemporaryDirectory() as data_set_dir:
+            vectors = create_random_2d_array(DEFAULT_NUM_VECTORS, DEFAULT_DIMENSION)
+            data_set_path = os.path.join(data_set_dir, "data.fbin")
+            BigANNBuilder().add_data_set_build_context(
+                DataSetBuildContext(DEFAULT_CONTEXT, vectors, data_set_path)).build()
+
+            data_set_instance = get_data_set("bigann", data_set_path, DEFAULT_CONTEXT, prefetch=True)
+            self.assertIsInstance(data_set_instance, PrefetchingDataSet)
+            self.assertEqual(data_set_instance.size(), DEFAULT_NUM_VECTORS)
+            np.testing.assert_array_equal(data_set_instance.read(4), vectors[0:4])
+            np.testing.assert_array_equal(data_set_instance.read(4), vectors[4:8])
+            # changing the chunk size discards the prefetched chunk
+            np.testing.assert_array_equal(data_set_instance.read(1), vectors[8:9])
+            np.testing.assert_array_equal(data_set_instance.read(1), vectors[9:10])
+            self.assertIsNone(data_set_instance.read(1))
+
+            data_set_instance.seek(2)
+            np.testing.assert_array_equal(data_set_instance.read(3), vectors[2:5])
+            data_set_instance.reset()
+            np.testing.assert_array_equal(data_set_instance.read(3), vectors[0:3])
+
     def testUnSupportedDataSetFormat(self):
         with self.assertRaises(ConfigurationError) as _:
             get_data_set("random", "/some/path", Context.INDEX)